@@ -1,10 +1,15 @@
+import io
 import os
-import json
+import hashlib
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import streamlit as st
 from gtts import gTTS
 from dotenv import load_dotenv
-from blog_generator import generate_blog, export_pdf
+from blog_generator import (
+    polish_answers, render_blog, export_pdf, json_loads, json_dumps_pretty
+)
 
 # ===== Load .env =====
 load_dotenv()
@@ -25,30 +30,156 @@ QUESTIONS = [
 
 # ===== Data file =====
 DATA_FILE = "data/memories.json"
-if not os.path.exists("data"):
-    os.makedirs("data")
+PDF_DIR = "pdf"
+PDF_LOG_FILE = os.path.join(PDF_DIR, "pdf_log.jsonl")
+LEGACY_PDF_LOG_FILE = os.path.join(PDF_DIR, "pdf_log.json")
+TTS_CACHE_DIR = "data/tts_cache"
+TTS_CACHE_MAX_BYTES = 50 * 1024 * 1024
+os.makedirs(TTS_CACHE_DIR, exist_ok=True)
 
-# Load existing answers
-if os.path.exists(DATA_FILE):
-    with open(DATA_FILE, "r") as f:
-        answers = json.load(f)
-else:
-    answers = {}
+
+def write_tts_cache(path, audio_bytes):
+    # Write to a temp file first so a cut-off write is never served as a hit
+    fd, tmp_path = tempfile.mkstemp(dir=TTS_CACHE_DIR, suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        f.write(audio_bytes)
+    os.replace(tmp_path, path)
+
+
+def evict_tts_cache(max_bytes=TTS_CACHE_MAX_BYTES):
+    """Delete the oldest cached mp3 files until the cache fits in max_bytes."""
+    files = []
+    for entry in os.scandir(TTS_CACHE_DIR):
+        if not entry.name.endswith(".mp3"):
+            # Leave in-flight temp files alone
+            continue
+        try:
+            stat = entry.stat()
+        except FileNotFoundError:
+            # Another session evicted it first
+            continue
+        files.append((stat.st_mtime, stat.st_size, entry.path))
+    files.sort()
+    total = sum(size for _, size, _ in files)
+    for _, size, path in files:
+        if total <= max_bytes:
+            break
+        total -= size
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+# ===== Cached loaders =====
+# mtime is part of the cache key so edits on disk invalidate the entry
+@st.cache_data(show_spinner=False)
+def load_answers(path, mtime):
+    with open(path, "rb") as f:
+        return json_loads(f.read())
+
+
+@st.cache_data(show_spinner=False)
+def load_pdf_log(path, mtime):
+    logs = []
+    with open(path, "rb") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                logs.append(json_loads(line))
+            except ValueError:
+                # Skip a truncated or corrupt line rather than failing the page
+                continue
+    return logs
+
+
+@st.cache_data(show_spinner=False)
+def load_legacy_pdf_log(path, mtime):
+    """Read the old pdf_log.json array written before the JSONL log."""
+    try:
+        with open(path, "rb") as f:
+            logs = json_loads(f.read())
+    except ValueError:
+        return []
+    return logs if isinstance(logs, list) else []
+
+
+@st.cache_data(show_spinner=False, max_entries=50)
+def read_pdf(path, mtime):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def _load_answers():
+    if os.path.exists(DATA_FILE):
+        return load_answers(DATA_FILE, os.path.getmtime(DATA_FILE))
+    return {}
+
+
+def _load_pdf_entries():
+    """Return logged PDFs that still exist on disk, newest first."""
+    logs = []
+    if os.path.exists(LEGACY_PDF_LOG_FILE):
+        logs += load_legacy_pdf_log(LEGACY_PDF_LOG_FILE, os.path.getmtime(LEGACY_PDF_LOG_FILE))
+    if os.path.exists(PDF_LOG_FILE):
+        logs += load_pdf_log(PDF_LOG_FILE, os.path.getmtime(PDF_LOG_FILE))
+    entries = []
+    for entry in reversed(logs):
+        if not isinstance(entry, dict) or "filename" not in entry:
+            continue
+        try:
+            mtime = os.path.getmtime(os.path.join(PDF_DIR, entry["filename"]))
+        except OSError:
+            continue
+        # mtime keys read_pdf's cache so a rewritten file is read again
+        entries.append(dict(entry, mtime=mtime))
+    return entries
+
+
+# Load once per session; later reruns reuse session state
+if "answers" not in st.session_state:
+    st.session_state.answers = _load_answers()
+if "pdf_entries" not in st.session_state:
+    st.session_state.pdf_entries = _load_pdf_entries()
+answers = st.session_state.answers
 
 # ===== Chat Interface =====
+# A form only reruns the script on submit, not on every edit. Every action
+# that reads the answers is a submit button, so one click commits the edits
+# and acts on them.
 st.subheader("✍ Share Your Memories")
-for i, q in enumerate(QUESTIONS):
-    answers[q] = st.text_area(f"Q{i+1}: {q}", value=answers.get(q, ""), height=100)
+with st.form("memories_form"):
+    for i, q in enumerate(QUESTIONS):
+        answers[q] = st.text_area(f"Q{i+1}: {q}", value=answers.get(q, ""), height=100)
+    save_clicked = st.form_submit_button("💾 Save My Answers")
+    generate_clicked = st.form_submit_button("📝 Generate Memory Blog with AI")
+    read_clicked = st.form_submit_button("🔊 Read My Memories")
 
 # ===== Save Answers =====
-if st.button("💾 Save My Answers"):
-    with open(DATA_FILE, "w") as f:
-        json.dump(answers, f, indent=4)
+if save_clicked:
+    with open(DATA_FILE, "wb") as f:
+        f.write(json_dumps_pretty(answers))
     st.success("✅ Answers saved!")
 
 # ===== Generate Blog =====
-if st.button("📝 Generate Memory Blog with AI"):
-    blog_html = generate_blog(answers)
+# PDFs render on a background worker so the page stays interactive. One
+# worker is shared by every session so renders never overlap.
+@st.cache_resource
+def get_pdf_executor():
+    return ThreadPoolExecutor(max_workers=1)
+
+
+if generate_clicked:
+    stories = polish_answers(answers, st.session_state.setdefault("polished", {}))
+    st.session_state.blog_html = render_blog(stories)
+    # The PDF gets style-free HTML; export_pdf applies the compiled stylesheet
+    st.session_state.pdf_future = get_pdf_executor().submit(
+        export_pdf, render_blog(stories, inline_style=False)
+    )
+
+if "blog_html" in st.session_state:
+    blog_html = st.session_state.blog_html
     st.components.v1.html(blog_html, height=500, scrolling=True)
 
     # Download HTML
@@ -59,47 +190,74 @@ if st.button("📝 Generate Memory Blog with AI"):
         mime="text/html"
     )
 
-    # Generate PDF safely
-    pdf_file = export_pdf(blog_html)
-    if pdf_file and os.path.exists(pdf_file):
-        with open(pdf_file, "rb") as f:
+    pdf_future = st.session_state.pdf_future
+    polling = not pdf_future.done()
+
+    # Only this fragment reruns while waiting, not the whole page
+    @st.fragment(run_every=1 if polling else None)
+    def show_pdf_download():
+        if not pdf_future.done():
+            st.info("⏳ Generating PDF...")
+            return
+        if st.session_state.get("pdf_listed") is not pdf_future:
+            # Full rerun to stop polling and pick up the new PDF in the list
+            st.session_state.pdf_listed = pdf_future
+            del st.session_state.pdf_entries
+            st.rerun()
+
+        try:
+            pdf_file, pdf_bytes = pdf_future.result()
+        except Exception as e:
+            print("PDF export failed:", e)
+            pdf_file, pdf_bytes = None, None
+        if pdf_bytes:
             st.download_button(
                 "⬇ Download Blog (PDF)",
-                f,
+                data=pdf_bytes,
                 file_name=os.path.basename(pdf_file),
                 mime="application/pdf"
             )
-    else:
-        st.error("⚠️ PDF generation failed.")
+        else:
+            st.error("⚠️ PDF generation failed.")
+
+    show_pdf_download()
 
 # ===== Show old PDFs =====
 st.subheader("📂 Previously Generated PDFs")
-pdf_dir = "pdf"
-log_file = os.path.join(pdf_dir, "pdf_log.json")
-if os.path.exists(log_file):
-    with open(log_file, "r") as f:
-        logs = json.load(f)
-    for entry in reversed(logs):
-        file_path = os.path.join(pdf_dir, entry["filename"])
-        if os.path.exists(file_path):
-            with open(file_path, "rb") as f:
-                st.download_button(
-                    f"⬇ {entry['filename']} ({entry['generated_at'][:16]})",
-                    f,
-                    file_name=entry["filename"],
-                    mime="application/pdf"
-                )
+if st.session_state.pdf_entries:
+    for entry in st.session_state.pdf_entries:
+        file_path = os.path.join(PDF_DIR, entry["filename"])
+        try:
+            pdf_bytes = read_pdf(file_path, entry["mtime"])
+        except FileNotFoundError:
+            # Deleted since the list was loaded
+            continue
+        st.download_button(
+            f"⬇ {entry['filename']} ({entry.get('generated_at', '')[:16]})",
+            data=pdf_bytes,
+            file_name=entry["filename"],
+            mime="application/pdf"
+        )
 else:
     st.info("No PDFs generated yet.")
 
 # ===== Text-to-Speech =====
-if st.button("🔊 Read My Memories"):
+if read_clicked:
     text = "\n".join([f"{q}: {a}" for q, a in answers.items() if a.strip()])
     if text:
-        tts = gTTS(text)
-        audio_file = "data/memories.mp3"
-        tts.save(audio_file)
-        audio_bytes = open(audio_file, "rb").read()
+        # Reuse audio for unchanged text instead of calling gTTS again
+        h = hashlib.sha1(text.encode()).hexdigest()[:16]
+        audio_file = os.path.join(TTS_CACHE_DIR, f"{h}.mp3")
+        try:
+            with open(audio_file, "rb") as f:
+                audio_bytes = f.read()
+        except FileNotFoundError:
+            # Synthesize into memory and only touch disk to fill the cache
+            buf = io.BytesIO()
+            gTTS(text).write_to_fp(buf)
+            audio_bytes = buf.getvalue()
+            write_tts_cache(audio_file, audio_bytes)
+            evict_tts_cache()
         st.audio(audio_bytes, format="audio/mp3")
     else:
         st.warning("Please answer some questions first.")
@@ -1,38 +1,177 @@
 import os
 import json
+import hashlib
+import tempfile
+import functools
+import html
+import io
+import string
+import threading
 from datetime import datetime
+from html.parser import HTMLParser
 from dotenv import load_dotenv
-from weasyprint import HTML
-from reportlab.pdfgen import canvas  # Fallback if WeasyPrint fails
 
 load_dotenv()
 
-# Load AI clients
-GENEMINI_AVAILABLE = False
-OPENAI_AVAILABLE = False
+# Load AI clients. Gemini, WeasyPrint and ReportLab are imported on first
+# use so they don't slow down the app's cold start.
+API_KEY = os.getenv("GOOGLE_API_KEY")
+# Only means a key is configured until _get_model() has tried the import;
+# after that it also reflects whether google.generativeai is installed.
+GENEMINI_AVAILABLE = bool(API_KEY)
 
-try:
-    import google.generativeai as genai
-    API_KEY = os.getenv("GOOGLE_API_KEY")
-    if API_KEY:
-        genai.configure(api_key=API_KEY)
-        GENEMINI_AVAILABLE = True
-except ImportError:
-    pass
+MODEL_NAME = "gemini-2.0-flash"
+CACHE_DIR = os.path.join("data", "polish_cache")
+STORY_MEMO_SIZE = 256
+_STORY_MEMO = {}
+
+STYLE_TEXT = """
+body { font-family: Georgia, serif; background: #f7f3f0; margin: 40px; }
+h1 { color: #5a3e36; text-align: center; }
+h2 { color: #4b3832; text-align: center; margin-top: 10px; }
+h3 { color: #4b3832; margin-top: 30px; }
+p { font-size: 18px; line-height: 1.6; color: #333; }
+.date { color: gray; font-size: 14px; text-align: center; margin-bottom: 20px; }
+hr { border: 1px solid #d4c6b8; }
+.container { background: #fff; padding: 30px; border-radius: 10px; 
+             box-shadow: 0px 0px 15px rgba(0,0,0,0.1); margin-bottom: 20px; }
+li { margin-bottom: 5px; }
+"""
+
+# Compiled once at import time; render_blog only fills in the placeholders.
+# $style is empty for the PDF path, which gets BLOG_CSS from WeasyPrint.
+BLOG_TEMPLATE = string.Template("""
+<html>
+<head>
+<title>Family Memories</title>
+$style
+</head>
+<body>
+<div class="container">
+<h1>💖 Family Memories</h1>
+<h2>$date</h2>
+<hr>
+<h3>Table of Contents</h3>
+<ul>$toc</ul>
+<hr>
+$body</div></body></html>""")
+
+# Pins the batch reply to [{"index": 0, "story": "..."}, ...]
+BATCH_RESPONSE_SCHEMA = {
+    "type": "array",
+    "items": {
+        "type": "object",
+        "properties": {
+            "index": {"type": "integer"},
+            "story": {"type": "string"},
+        },
+        "required": ["index", "story"],
+    },
+}
+
+_MODEL = None
+_MODEL_LOCK = threading.Lock()
+_PDF_LOCK = threading.Lock()
 
 try:
-    import openai
-    OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-    if OPENAI_API_KEY:
-        openai.api_key = OPENAI_API_KEY
-        OPENAI_AVAILABLE = True
+    import orjson
+    ORJSON_AVAILABLE = True
 except ImportError:
-    pass
+    ORJSON_AVAILABLE = False
+
+
+def json_loads(data: bytes):
+    return orjson.loads(data) if ORJSON_AVAILABLE else json.loads(data)
+
+
+def json_dumps(obj) -> bytes:
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(obj)
+    return json.dumps(obj).encode("utf-8")
+
+
+def json_dumps_pretty(obj) -> bytes:
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2)
+    return json.dumps(obj, indent=2).encode("utf-8")
+
+
+def _get_model():
+    """Import Gemini and build the shared model on first use."""
+    global _MODEL, GENEMINI_AVAILABLE
+    with _MODEL_LOCK:
+        if _MODEL is None and GENEMINI_AVAILABLE:
+            try:
+                import google.generativeai as genai
+            except ImportError:
+                GENEMINI_AVAILABLE = False
+                return None
+            genai.configure(api_key=API_KEY)
+            # Shared across threads so each story doesn't rebuild the client
+            _MODEL = genai.GenerativeModel(MODEL_NAME)
+        return _MODEL
+
+
+@functools.lru_cache(maxsize=None)
+def _pdf_styles():
+    """Return the shared WeasyPrint font config and compiled blog stylesheet."""
+    from weasyprint import CSS
+    from weasyprint.text.fonts import FontConfiguration
+
+    font_config = FontConfiguration()
+    return font_config, CSS(string=STYLE_TEXT, font_config=font_config)
+
+
+def _cache_path(question, answer):
+    key = hashlib.sha256((question + "\x00" + answer + "\x00" + MODEL_NAME).encode()).hexdigest()
+    return os.path.join(CACHE_DIR, f"{key}.txt")
+
+
+def _write_cache(path, story):
+    # Write to a temp file first so readers never see a partial entry
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=CACHE_DIR, suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        f.write(story)
+    os.replace(tmp_path, path)
+
+
+def _cached_story(question, answer):
+    """Return a polished story from memory or the disk cache, or None."""
+    key = (question, answer)
+    if key in _STORY_MEMO:
+        return _STORY_MEMO[key]
+    try:
+        with open(_cache_path(question, answer), "r", encoding="utf-8") as f:
+            story = f.read()
+    except FileNotFoundError:
+        return None
+    _remember_story(key, story)
+    return story
+
+
+def _remember_story(key, story):
+    # Small in-process layer over the disk cache; oldest entries go first
+    if key not in _STORY_MEMO and len(_STORY_MEMO) >= STORY_MEMO_SIZE:
+        _STORY_MEMO.pop(next(iter(_STORY_MEMO)), None)
+    _STORY_MEMO[key] = story
+
+
+def _store_story(question, answer, story):
+    _write_cache(_cache_path(question, answer), story)
+    _remember_story((question, answer), story)
 
 
 def polish_story(question, answer, model=None):
     if not answer.strip():
         return ""
+    if model is None:
+        model = _get_model()
+    if model is None:
+        return answer
+    story = _cached_story(question, answer)
+    if story is not None:
+        return story
     prompt = f"""
     Turn the following memory into a warm, family-friendly story.
     Question: {question}
@@ -40,60 +179,190 @@ def polish_story(question, answer, model=None):
     Story:
     """
     try:
-        if model is None and GENEMINI_AVAILABLE:
-            model = genai.GenerativeModel("gemini-2.0-flash")
-            response = model.generate_content(prompt)
-            return response.text.strip()
-        else:
-            return answer
+        response = model.generate_content(prompt)
+        story = response.text.strip()
     except Exception as e:
         print("Gemini error:", e)
         return answer
+    _store_story(question, answer, story)
+    return story
 
 
-def generate_blog(answers: dict) -> str:
-    """Generate polished HTML blog with cover page and Table of Contents."""
+def _parse_batch_stories(result) -> dict:
+    """Map index (as str) to story from the shapes Gemini tends to return."""
+    if isinstance(result, dict) and len(result) == 1:
+        # Unwrap {"stories": [...]} or {"stories": {...}}, but not a lone
+        # index entry such as {"0": ...}
+        key, inner = next(iter(result.items()))
+        if isinstance(inner, list) or (isinstance(inner, dict) and not str(key).isdigit()):
+            result = inner
+    if isinstance(result, dict):
+        items = list(result.items())
+    elif isinstance(result, list):
+        items = [(entry.get("index", i) if isinstance(entry, dict) else i, entry)
+                 for i, entry in enumerate(result)]
+    else:
+        items = []
+    return {str(k): v.get("story") if isinstance(v, dict) else v for k, v in items}
+
+
+def polish_stories_batch(answers: dict, model=None) -> dict:
+    """Polish every non-empty answer with a single Gemini request."""
+    pending = {q: a for q, a in answers.items() if a.strip()}
+    if model is None:
+        model = _get_model()
+    if model is None:
+        return pending
+
+    stories = {}
+    missing = []
+    for q, a in pending.items():
+        story = _cached_story(q, a)
+        if story is not None:
+            stories[q] = story
+        else:
+            missing.append(q)
+    if not missing:
+        return stories
+
+    items = [{"index": i, "question": q, "answer": pending[q]} for i, q in enumerate(missing)]
+    prompt = (
+        "Rewrite each of the following memories as a warm, family-friendly story. "
+        'Return a JSON array with one object per memory, shaped like '
+        '[{"index": 0, "story": "<story>"}, ...], using the index given below.\n\n'
+        + json.dumps(items)
+    )
+    try:
+        response = model.generate_content(
+            prompt, generation_config={
+                "response_mime_type": "application/json",
+                "response_schema": BATCH_RESPONSE_SCHEMA,
+            }
+        )
+        result = _parse_batch_stories(json_loads(response.text))
+    except Exception as e:
+        print("Gemini error:", e)
+        result = {}
+
+    for i, q in enumerate(missing):
+        story = result.get(str(i))
+        if isinstance(story, str) and story.strip():
+            stories[q] = story.strip()
+            _store_story(q, pending[q], stories[q])
+        else:
+            print(f"Gemini returned no story for index {i}, using the raw answer")
+            stories[q] = pending[q]
+    return {q: stories[q] for q in pending}
+
+
+def polish_answers(answers: dict, polished_cache: dict = None) -> dict:
+    """Return {question: story} for every non-empty answer, in answer order.
+
+    polished_cache maps (question, answer) to an already polished story and
+    is filled in with new results, so unchanged answers skip Gemini.
+    """
+    if polished_cache is None:
+        polished_cache = {}
+    pending = {q: a for q, a in answers.items() if a.strip()}
+    misses = {q: a for q, a in pending.items() if (q, a) not in polished_cache}
+
+    # One Gemini round-trip for every new answer instead of one per question
+    fresh = polish_stories_batch(misses) if misses else {}
+    for q, story in fresh.items():
+        # Unpolished fallbacks are not remembered so a later click can retry
+        if story != misses[q]:
+            polished_cache[(q, misses[q])] = story
+
+    return {q: polished_cache.get((q, a), fresh.get(q, a)) for q, a in pending.items()}
+
+
+def render_blog(stories: dict, inline_style: bool = True) -> str:
+    """Render polished stories as an HTML blog with cover page and Table of Contents.
+
+    Pass inline_style=False for HTML headed to export_pdf, which applies the
+    precompiled stylesheet itself.
+    """
     date_str = datetime.now().strftime("%B %d, %Y")
-    toc = "".join([f"<li>{q}</li>" for q in answers if answers[q].strip()])
+    toc = "".join([f"<li>{html.escape(q)}</li>" for q in stories])
+    body = "".join(
+        f"<div class='container'><h3>{html.escape(q)}</h3><p>{html.escape(p)}</p></div>"
+        for q, p in stories.items()
+    )
+    style = f"<style>{STYLE_TEXT}</style>" if inline_style else ""
+    return BLOG_TEMPLATE.substitute(style=style, date=date_str, toc=toc, body=body)
 
-    blog = f"""
-<html>
-<head>
-<title>Family Memories</title>
-<style>
-body {{ font-family: Georgia, serif; background: #f7f3f0; margin: 40px; }}
-h1 {{ color: #5a3e36; text-align: center; }}
-h2 {{ color: #4b3832; text-align: center; margin-top: 10px; }}
-h3 {{ color: #4b3832; margin-top: 30px; }}
-p {{ font-size: 18px; line-height: 1.6; color: #333; }}
-.date {{ color: gray; font-size: 14px; text-align: center; margin-bottom: 20px; }}
-hr {{ border: 1px solid #d4c6b8; }}
-.container {{ background: #fff; padding: 30px; border-radius: 10px; 
-             box-shadow: 0px 0px 15px rgba(0,0,0,0.1); margin-bottom: 20px; }}
-li {{ margin-bottom: 5px; }}
-</style>
-</head>
-<body>
-<div class="container">
-<h1>💖 Family Memories</h1>
-<h2>{date_str}</h2>
-<hr>
-<h3>Table of Contents</h3>
-<ul>{toc}</ul>
-<hr>
-"""
 
-    for q, a in answers.items():
-        if a.strip():
-            polished = polish_story(q, a)
-            blog += f"<div class='container'><h3>{q}</h3><p>{polished}</p></div>"
+def generate_blog(answers: dict, polished_cache: dict = None, inline_style: bool = True) -> str:
+    """Generate polished HTML blog with cover page and Table of Contents."""
+    return render_blog(polish_answers(answers, polished_cache), inline_style)
+
+
+class _TextExtractor(HTMLParser):
+    """Collect visible text from the blog HTML, one block element per line."""
+
+    BLOCK_TAGS = {"h1", "h2", "h3", "p", "li", "div", "hr", "br"}
+
+    def __init__(self):
+        super().__init__()
+        self.chunks = []
+        self._skip = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in ("style", "title"):
+            self._skip += 1
+        elif tag in self.BLOCK_TAGS:
+            self.chunks.append("\n")
+
+    def handle_endtag(self, tag):
+        if tag in ("style", "title"):
+            self._skip -= 1
+        elif tag in self.BLOCK_TAGS:
+            self.chunks.append("\n")
+
+    def handle_data(self, data):
+        if not self._skip:
+            self.chunks.append(data)
+
 
-    blog += "</body></html>"
-    return blog
+def _html_to_text(html_content):
+    parser = _TextExtractor()
+    parser.feed(html_content)
+    parser.close()
+    lines = (line.strip() for line in "".join(parser.chunks).splitlines())
+    return "\n".join(line for line in lines if line)
 
 
-def export_pdf(html_content: str, directory="pdf") -> str:
-    """Export blog to PDF with fallback if WeasyPrint fails."""
+def _text_pdf_bytes(text, font="Times-Roman", size=12, margin=40) -> bytes:
+    """Render plain text to a multi-page PDF with ReportLab."""
+    from reportlab.pdfgen import canvas
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.utils import simpleSplit
+
+    width, height = A4
+    buf = io.BytesIO()
+    c = canvas.Canvas(buf, pagesize=A4)
+    leading = size * 1.2
+    lines = simpleSplit(text, font, size, width - 2 * margin) or [""]
+    per_page = int((height - 2 * margin) // leading)
+    for start in range(0, len(lines), per_page):
+        c.setFont(font, size)
+        y = height - margin
+        for line in lines[start:start + per_page]:
+            c.drawString(margin, y, line)
+            y -= leading
+        c.showPage()
+    c.save()
+    return buf.getvalue()
+
+
+def export_pdf(html_content: str, directory="pdf") -> tuple:
+    """Export blog to PDF with fallback if WeasyPrint fails.
+
+    html_content should come from render_blog(..., inline_style=False);
+    BLOG_CSS is always applied, so an inline copy would only be parsed twice.
+    Returns (filepath, pdf_bytes); the file is kept on disk for the history
+    list and the bytes can be handed straight to a download button.
+    """
     if not os.path.exists(directory):
         os.makedirs(directory)
 
@@ -102,36 +371,36 @@ def export_pdf(html_content: str, directory="pdf") -> str:
     filepath = os.path.join(directory, filename)
 
     try:
-        # Try WeasyPrint first
-        HTML(string=html_content).write_pdf(filepath)
+        # Try WeasyPrint first, with the precompiled stylesheet
+        from weasyprint import HTML
+
+        # The shared font config and stylesheet aren't guaranteed thread-safe
+        with _PDF_LOCK:
+            font_config, blog_css = _pdf_styles()
+            pdf_bytes = HTML(string=html_content).write_pdf(
+                stylesheets=[blog_css], font_config=font_config
+            )
     except Exception as e:
         print("WeasyPrint failed, falling back to ReportLab:", e)
         # Fallback to simple text PDF
-        c = canvas.Canvas(filepath)
-        textobject = c.beginText(40, 800)
-        textobject.setFont("Times-Roman", 12)
-        for line in html_content.splitlines():
-            textobject.textLine(line)
-        c.drawText(textobject)
-        c.showPage()
-        c.save()
-
-    # Log PDFs
-    log_file = os.path.join(directory, "pdf_log.json")
-    log = []
-    if os.path.exists(log_file):
-        try:
-            with open(log_file, "r") as f:
-                log = json.load(f)
-        except json.JSONDecodeError:
-            log = []
+        pdf_bytes = _text_pdf_bytes(_html_to_text(html_content))
+
+    with open(filepath, "wb") as f:
+        f.write(pdf_bytes)
+
+    # Log PDFs as one JSON object per line; a single O_APPEND write keeps
+    # concurrent exports from clobbering each other
+    log_file = os.path.join(directory, "pdf_log.jsonl")
     preview = "".join(html_content.splitlines())[:50]
-    log.append({
+    entry = {
         "filename": filename,
         "generated_at": datetime.now().isoformat(),
         "preview": preview
-    })
-    with open(log_file, "w") as f:
-        json.dump(log, f, indent=4)
+    }
+    fd = os.open(log_file, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+    try:
+        os.write(fd, json_dumps(entry) + b"\n")
+    finally:
+        os.close(fd)
 
-    return filepath
+    return filepath, pdf_bytes